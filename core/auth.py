@@ -1,3 +1,5 @@
+import hmac
+
 from fastapi import Depends, HTTPException
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 
@@ -5,9 +7,17 @@ import env
 
 auth_scheme = HTTPBearer()
 
+password = env.PASSWORD.encode() if env.PASSWORD else None
+"""Encoded password, None when authentication is disabled"""
+
+
+def verify_password(credentials: str) -> bool:
+    """Compare credentials with the password in constant time"""
+    return password is None or hmac.compare_digest(credentials.encode(), password)
+
 
 def upload_role(token: HTTPAuthorizationCredentials = Depends(auth_scheme)):
-    if env.PASSWORD and token.credentials != env.PASSWORD:
+    if not verify_password(token.credentials):
         raise HTTPException(
             status_code=401,
             detail="Unauthorized",
@@ -15,7 +25,7 @@ def upload_role(token: HTTPAuthorizationCredentials = Depends(auth_scheme)):
 
 
 def delete_role(token: HTTPAuthorizationCredentials = Depends(auth_scheme)):
-    if env.PASSWORD and token.credentials != env.PASSWORD:
+    if not verify_password(token.credentials):
         raise HTTPException(
             status_code=401,
             detail="Unauthorized",
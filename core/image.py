@@ -1,31 +1,92 @@
 import asyncio
 import io
-from concurrent.futures import Future, ThreadPoolExecutor
+import logging
+import multiprocessing
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from dataclasses import dataclass
+from itertools import repeat
 from os import path
+from typing import BinaryIO, Callable
 
-import aiofiles
-import aiofiles.os
 import PIL.Image
-import pillow_avif  # DO NOT REMOVE
-from PIL import ImageFile, ImageOps
+from PIL import ImageFile, ImageOps, ImageSequence, features
 from PIL.Image import Image as PILImage
-from sqlalchemy import delete, select
+from sqlalchemy import delete, insert, select
 
 import env
 from db import scope
 from models.dto.image import ImageConfig
 from models.image import Image, ImageGroup
+from utils.files import remove_files
 
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 
+logger = logging.getLogger(__name__)
+
+PILLOW_SIMD: bool = ".post" in PIL.__version__
+"""Pillow-SIMD is installed (its versions carry a `.postN` suffix)"""
+
+if env.OPENCV_RESIZE:
+    import cv2
+    import numpy as np
+
+OPENCV_MODES = ["L", "RGB"]
+"""Modes resized with OpenCV, the others (alpha, palette) keep Pillow's handling"""
+
+RESAMPLE_MODES = ["1", "L", "LA", "RGB", "RGBA", "P", "CMYK"]
+"""Modes Pillow resamples as they are, the others (16-bit, float) are converted before the shared downscale"""
+
+ANIMATED_CONTENT_TYPES = ["image/gif", "image/webp", "image/avif"]
+"""Content types that keep every frame"""
+
+IMAGE_PATH_PREFIX = path.join(env.IMAGE_PATH, "")
+"""Image directory with a trailing separator, real paths are a single concatenation"""
+
 thread_pool = ThreadPoolExecutor(max_workers=env.IMAGE_PROCESSING_THREAD)
 
+process_pool: ProcessPoolExecutor | None = None
+"""Image worker processes, started by the first get_process_pool call"""
+
+process_pool_lock = threading.Lock()
+
+encoder_local = threading.local()
+"""Per-thread encoder buffer, reused across encodes in the same worker"""
+
+ENCODER_BUFFER_LIMIT = 1 << 24
+"""Largest encoder buffer preallocated and kept per thread (16 MiB), larger outputs grow a temporary one"""
+
+
+def log_image_backends():
+    """Log the Pillow build in use, called once from the app instead of in every pool worker"""
+    if PILLOW_SIMD:
+        logger.info("Using Pillow-SIMD %s", PIL.__version__)
+    else:
+        logger.warning("Using stock Pillow %s, install Pillow-SIMD for faster resizing", PIL.__version__)
+
+    if not features.check_feature("libjpeg_turbo"):
+        logger.warning("Pillow is not linked against libjpeg-turbo, JPEG encoding will be slow")
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Image worker process pool, created on first use so the workers importing this module never build one"""
+    global process_pool
+
+    # Called from the event loop and from the thread pool
+    with process_pool_lock:
+        if process_pool is None:
+            process_pool = ProcessPoolExecutor(
+                max_workers=env.IMAGE_PROCESSING_THREAD,
+                mp_context=multiprocessing.get_context("forkserver"),
+            )
+
+    return process_pool
+
 
 @dataclass
 class ProcessedImage:
     tag: str
-    image: bytes
     size: int
     width: int
     height: int
@@ -34,82 +95,181 @@ class ProcessedImage:
     extension: str
 
 
-def transform_image(image: PILImage, config: ImageConfig) -> PILImage:
-    """Transform image"""
+@dataclass
+class RawFrame:
+    """Decoded frame, pickled as one flat buffer instead of a copied image"""
+
+    mode: str
+    size: tuple[int, int]
+    data: bytes
+    palette: list[int] | None
+    info: dict
+
+    @classmethod
+    def from_image(cls, image: PILImage) -> "RawFrame":
+        return cls(
+            mode=image.mode,
+            size=image.size,
+            data=image.tobytes(),
+            palette=image.getpalette(),
+            info=dict(image.info),
+        )
 
-    match config.fit:
-        case "cover":
-            image = ImageOps.fit(
-                image, (config.width, config.height), method=0, bleed=0.0, centering=(0.5, 0.5)
-            )
+    def to_image(self) -> PILImage:
+        image = PIL.Image.frombytes(self.mode, self.size, self.data)
 
-        case "contain":
-            image = image.copy()
-            image.thumbnail((config.width, config.height))
+        if self.palette:
+            image.putpalette(self.palette)
 
-        case "fill":
-            image = ImageOps.fit(
-                image, (config.width, config.height), method=0, bleed=0.0, centering=(0.5, 0.5)
-            )
+        image.info = self.info
+        return image
+
+
+def contain_size(size: tuple[int, int], box: tuple[int, int]) -> tuple[int, int]:
+    """Largest size that fits in the box keeping the aspect ratio, never upscaled"""
+    width, height = size
+    scale = min(box[0] / width, box[1] / height, 1)
 
-        case "inside":
-            image = image.copy()
-            image.thumbnail((config.width, config.height))
+    return max(round(width * scale), 1), max(round(height * scale), 1)
 
-        case "outside":
-            image = image.copy()
-            image.thumbnail((config.width, config.height))
+
+def cover_box(size: tuple[int, int], target: tuple[int, int]) -> tuple[int, int, int, int]:
+    """Centered crop box with the aspect ratio of the target"""
+    width, height = size
+    aspect = target[0] / target[1]
+
+    if width / height > aspect:
+        crop_width, crop_height = max(round(height * aspect), 1), height
+    else:
+        crop_width, crop_height = width, max(round(width / aspect), 1)
+
+    left = (width - crop_width) // 2
+    top = (height - crop_height) // 2
+
+    return left, top, left + crop_width, top + crop_height
+
+
+def opencv_resize(array: "np.ndarray", size: tuple[int, int]) -> PILImage:
+    """Resize pixel array with OpenCV, area interpolation when downscaling"""
+    height, width = array.shape[:2]
+    interpolation = cv2.INTER_AREA if size[0] <= width and size[1] <= height else cv2.INTER_LANCZOS4
+
+    return PIL.Image.fromarray(cv2.resize(array, size, interpolation=interpolation))
+
+
+def resize_image(image: PILImage, size: tuple[int, int]) -> PILImage:
+    """Resize image"""
+    if env.OPENCV_RESIZE and image.mode in OPENCV_MODES:
+        return opencv_resize(np.asarray(image), size)
+
+    return image.resize(size, PIL.Image.LANCZOS, reducing_gap=3.0)
+
+
+def fit_image(image: PILImage, size: tuple[int, int]) -> PILImage:
+    """Crop image to the aspect ratio of the size and resize it"""
+    if env.OPENCV_RESIZE and image.mode in OPENCV_MODES:
+        left, top, right, bottom = cover_box(image.size, size)
+        return opencv_resize(np.asarray(image)[top:bottom, left:right], size)
+
+    return ImageOps.fit(image, size, method=0, bleed=0.0, centering=(0.5, 0.5))
+
+
+def compile_transform(config: ImageConfig) -> Callable[[PILImage], PILImage]:
+    """Specialize the transform of the config, returns a function of a source image to a new image"""
+    size = (config.width, config.height)
+
+    match config.fit:
+        case "cover" | "fill":
+            return lambda image: fit_image(image, size)
+
+        case "contain" | "inside" | "outside":
+            return lambda image: resize_image(image, contain_size(image.size, size))
 
         case _:
-            pass
+            return PILImage.copy
 
-    return image
 
+def register_avif():
+    """Register the AVIF plugin, it is only imported once an AVIF image is read or written"""
+    import pillow_avif  # noqa: F401
 
-def process_image(image: PILImage, config: ImageConfig) -> ProcessedImage:
-    """Process image"""
 
-    if config.content_type == "image/jpeg":
-        image = image.convert("RGB")
+def open_image(file: str | BinaryIO) -> PILImage:
+    """Open image, registering the AVIF plugin when no loaded plugin identifies it"""
+    try:
+        return PIL.Image.open(file)
+    except PIL.UnidentifiedImageError:
+        if "pillow_avif" in sys.modules:
+            raise
+
+    register_avif()
+
+    if not isinstance(file, str):
+        file.seek(0)
+
+    return PIL.Image.open(file)
+
+
+def write_file(file_path: str, data: bytes | memoryview):
+    """Write a file"""
+    with open(file_path, "wb") as f:
+        f.write(data)
 
-    info = getattr(image, "info", {})
-    n_frames = (
-        getattr(image, "n_frames", 1)
-        if config.content_type in ["image/gif", "image/webp", "image/avif"]
-        else 1
-    )
-    frames: list[PILImage | Future[PILImage]] = []
 
-    for frame in range(n_frames):
-        image.seek(frame)
-        frames.append(thread_pool.submit(transform_image, image.copy(), config))
+def encoder_buffer(capacity: int) -> io.BytesIO:
+    """Thread-local encoder buffer rewound to the start, preallocated to the capacity up to the limit"""
+    image_bytes: io.BytesIO | None = getattr(encoder_local, "image_bytes", None)
+    capacity = min(capacity, ENCODER_BUFFER_LIMIT)
+
+    # Growing a BytesIO reallocates and copies it, allocate the estimate once up front instead
+    if image_bytes is None or image_bytes.seek(0, io.SEEK_END) < capacity:
+        image_bytes = encoder_local.image_bytes = io.BytesIO(bytes(capacity))
+
+    image_bytes.seek(0)
+    return image_bytes
+
+
+def encode_image(group_id: str, frames: list[PILImage], config: ImageConfig, info: dict) -> ProcessedImage:
+    """Encode frames and write them to the image's real path"""
 
-    frames = [future.result() for future in frames]
     extension = config.content_type.split("/")[1]
 
-    with io.BytesIO() as image_bytes:
-        frames[0].save(
-            image_bytes,
-            format=extension,
-            quality=config.quality,
-            append_images=frames[1:],
-            optimize=True,
-            **(
-                {
-                    "save_all": True,
-                    "duration": info.get("duration", 0),
-                    "loop": info.get("loop", 0),
-                }
-                if n_frames > 1
-                else {}
-            ),
-        )
-        image_bytes = image_bytes.getvalue()
+    if extension == "avif":
+        register_avif()
+
+    # Estimated from the first frame, animations compress their frames against each other
+    image_bytes = encoder_buffer(frames[0].width * frames[0].height * 3 // 4)
+
+    frames[0].save(
+        image_bytes,
+        format=extension,
+        quality=config.quality,
+        append_images=frames[1:],
+        optimize=config.optimize,
+        **(
+            {
+                "save_all": True,
+                "duration": info.get("duration", 0),
+                "loop": info.get("loop", 0),
+            }
+            if len(frames) > 1
+            else {}
+        ),
+    )
+
+    # Write the encoded part of the buffer as is, getvalue() would copy the whole payload
+    size = image_bytes.tell()
+
+    with image_bytes.getbuffer() as buffer:
+        write_file(image_real_path(group_id, config.tag), buffer[:size])
+
+    # A buffer grown past the limit is not kept by the thread
+    if image_bytes.seek(0, io.SEEK_END) > ENCODER_BUFFER_LIMIT:
+        del encoder_local.image_bytes
 
     return ProcessedImage(
         tag=config.tag,
-        image=image_bytes,
-        size=len(image_bytes),
+        size=size,
         width=frames[0].width,
         height=frames[0].height,
         quality=config.quality,
@@ -118,14 +278,84 @@ def process_image(image: PILImage, config: ImageConfig) -> ProcessedImage:
     )
 
 
+def process_image(group_id: str, image: PILImage | bytes | str, config: ImageConfig) -> ProcessedImage:
+    """Process the first frame of an image and write it to its real path"""
+
+    if isinstance(image, bytes):
+        image = open_image(io.BytesIO(image))
+    elif isinstance(image, str):
+        image = open_image(image)
+
+    if config.content_type == "image/jpeg":
+        image = image.convert("RGB")
+
+    return encode_image(group_id, [compile_transform(config)(image)], config, image.info)
+
+
+def transform_frames(frames: list[RawFrame], config: ImageConfig) -> list[PILImage]:
+    """Transform a batch of frames"""
+    transform = compile_transform(config)
+    return [transform(frame.to_image()) for frame in frames]
+
+
+def process_animated_image(group_id: str, frames: list[RawFrame], config: ImageConfig) -> ProcessedImage:
+    """Process every frame of an image and write it to its real path"""
+
+    # One batch of frames per worker process
+    batch_size = -(-len(frames) // env.IMAGE_PROCESSING_THREAD)
+    batches = get_process_pool().map(
+        transform_frames,
+        [frames[i : i + batch_size] for i in range(0, len(frames), batch_size)],
+        repeat(config),
+    )
+
+    return encode_image(group_id, [frame for batch in batches for frame in batch], config, frames[0].info)
+
+
+def read_frames(image: PILImage) -> list[RawFrame]:
+    """Decode every frame of an image"""
+    # The iterator yields the seeked image itself, each frame is snapshotted as one flat buffer
+    return [RawFrame.from_image(frame) for frame in ImageSequence.Iterator(image)]
+
+
+def intermediate_scale(size: tuple[int, int], configs: list[ImageConfig]) -> float:
+    """Smallest uniform scale that keeps the image twice as large as every config needs"""
+    width, height = size
+
+    return 2 * max(
+        (max if config.fit in ["cover", "fill"] else min)(config.width / width, config.height / height)
+        for config in configs
+    )
+
+
+def intermediate_image(image: PILImage, scale: float) -> PILImage:
+    """Downscale the image once so that every config can be derived from it"""
+    width, height = image.size
+    size = (max(round(width * scale), 1), max(round(height * scale), 1))
+
+    # JPEG is decoded at the smallest DCT scale (1/2, 1/4, 1/8) that still covers the size, a no-op otherwise
+    image.draft("RGB", size)
+
+    if image.mode not in RESAMPLE_MODES:
+        image = image.convert("RGBA" if image.has_transparency_data else "RGB")
+
+    return resize_image(image, size)
+
+
 @dataclass
 class ImageProcessingResult:
     id: str
     images: list[ProcessedImage]
 
 
+def read_image_file(file: BinaryIO) -> bytes:
+    """Read the whole image file from the start"""
+    file.seek(0)
+    return file.read()
+
+
 async def save_image(
-    image: PILImage | bytes | io.BytesIO,
+    image: PILImage | bytes | BinaryIO | str,
     configs: list[ImageConfig],
     filename: str = "image.jpg",
     content_type: str = "image/jpeg",
@@ -136,57 +366,79 @@ async def save_image(
         raise ValueError("No image configuration")
 
     loop = asyncio.get_event_loop()
+    # Sources opened from a path own their file handle
+    opened = isinstance(image, str)
 
-    if not isinstance(image, PILImage):
+    if isinstance(image, PILImage):
+        source = image
+    else:
         if isinstance(image, bytes):
             image = io.BytesIO(image)
 
-        image = await loop.run_in_executor(thread_pool, PIL.Image.open, image)
-        await loop.run_in_executor(thread_pool, image.load)
-
-    features = [loop.run_in_executor(thread_pool, process_image, image, config) for config in configs]
-
-    async with scope() as session:
-        group = ImageGroup(
-            filename=filename,
-            width=image.width,
-            height=image.height,
-            content_type=content_type,
+        # Only the header is parsed here
+        source = await loop.run_in_executor(thread_pool, open_image, image)
+
+    try:
+        width, height = source.size
+        n_frames = getattr(source, "n_frames", 1)
+        scale = intermediate_scale(source.size, configs)
+
+        if n_frames == 1 and scale <= 0.5:
+            # Every config is derived from one shared downscale instead of each worker decoding the original
+            image = await loop.run_in_executor(thread_pool, intermediate_image, source, scale)
+        elif not isinstance(image, (PILImage, str)):
+            # Each worker process decodes its own copy, files on disk are opened by the workers themselves
+            image = await loop.run_in_executor(thread_pool, read_image_file, image)
+
+        # Animated outputs share frames decoded once here, their batches are spread over the worker processes
+        frames = (
+            await loop.run_in_executor(thread_pool, read_frames, source)
+            if n_frames > 1 and any(config.content_type in ANIMATED_CONTENT_TYPES for config in configs)
+            else None
         )
+    finally:
+        if opened:
+            source.close()
 
-        session.add(group)
+    async with scope() as session:
+        group_id = (
+            await session.execute(
+                insert(ImageGroup).values(
+                    filename=filename,
+                    width=width,
+                    height=height,
+                    content_type=content_type,
+                )
+            )
+        ).inserted_primary_key[0]
         await session.commit()
-        await session.refresh(group, ["id"])
-
-        group_id = group.id
-
-        images = []
-
-        while features:
-            done, features = await asyncio.wait(features, return_when=asyncio.FIRST_COMPLETED)
-
-            for future in done:
-                processed: ProcessedImage = future.result()
-
-                async with aiofiles.open(
-                    image_real_path(group_id, processed.tag),
-                    "wb",
-                ) as f:
-                    await f.write(processed.image)
-
-                session.add(
-                    Image(
-                        group_id=group_id,
-                        tag=processed.tag,
-                        size=processed.size,
-                        width=processed.width,
-                        height=processed.height,
-                        quality=processed.quality,
-                        content_type=processed.content_type,
-                    )
+
+        images: list[ProcessedImage] = await asyncio.gather(
+            *[
+                (
+                    loop.run_in_executor(thread_pool, process_animated_image, group_id, frames, config)
+                    if frames and config.content_type in ANIMATED_CONTENT_TYPES
+                    else loop.run_in_executor(get_process_pool(), process_image, group_id, image, config)
                 )
-                images.append(processed)
+                for config in configs
+            ]
+        )
 
+        await session.execute(
+            insert(Image),
+            [
+                {
+                    "group_id": group_id,
+                    "tag": processed.tag,
+                    "size": processed.size,
+                    "width": processed.width,
+                    "height": processed.height,
+                    "quality": processed.quality,
+                    "content_type": processed.content_type,
+                }
+                for processed in images
+            ],
+        )
         await session.commit()
 
         return ImageProcessingResult(
@@ -197,7 +449,7 @@ async def save_image(
 
 def image_real_path(group_id: str, tag: str) -> str:
     """Get real path"""
-    return path.join(env.IMAGE_PATH, f"{group_id}_{tag}")
+    return f"{IMAGE_PATH_PREFIX}{group_id}_{tag}"
 
 
 async def remove_image(group_id: str) -> bool:
@@ -213,8 +465,6 @@ async def remove_image(group_id: str) -> bool:
         await session.execute(delete(ImageGroup).where(ImageGroup.id == group_id))
         await session.commit()
 
-    for tag in tags:
-        if await aiofiles.os.path.exists(image_real_path(group_id, tag)):
-            await aiofiles.os.remove(image_real_path(group_id, tag))
+    await remove_files([image_real_path(group_id, tag) for tag in tags])
 
     return True
@@ -1,20 +1,23 @@
 import asyncio
-import os
-from concurrent.futures import ThreadPoolExecutor
+import json
+from asyncio.subprocess import PIPE
 from dataclasses import dataclass
 from os import path
-from uuid import uuid4
 
 import aiofiles.os
-from moviepy.editor import VideoClip, VideoFileClip
-from sqlalchemy import delete, select
+from sqlalchemy import delete, insert, select
 
 import env
 from db import scope
 from models.dto.video import VideoConfig
 from models.video import Video, VideoGroup
+from utils.files import remove_files
 
-thread_pool = ThreadPoolExecutor(max_workers=env.VIDEO_PROCESSING_THREAD)
+process_semaphore = asyncio.Semaphore(env.VIDEO_PROCESSING_THREAD)
+"""Limits the number of concurrent ffmpeg processes"""
+
+VIDEO_PATH_PREFIX = path.join(env.VIDEO_PATH, "")
+"""Video directory with a trailing separator, real paths are a single concatenation"""
 
 extensions_dict: dict[str, str] = {
     "libx264": "mp4",
@@ -25,6 +28,15 @@ extensions_dict: dict[str, str] = {
 }
 
 
+@dataclass
+class VideoInfo:
+    width: int
+    height: int
+    duration: float
+    frame_rate: float
+    audio: bool
+
+
 @dataclass
 class ProcessedVideo:
     tag: str
@@ -41,18 +53,77 @@ class ProcessedVideo:
     audio_sample_rate: int | None
 
 
-def process_video(group_id: str, video: VideoClip, config: VideoConfig) -> ProcessedVideo:
-    """Process video"""
-    if config.start is not None or config.end is not None:
-        video = video.subclip(config.start or 0, config.end)
+async def run_process(*args: str) -> bytes:
+    """Run a process and return its standard output"""
+    process = await asyncio.create_subprocess_exec(*args, stdout=PIPE, stderr=PIPE)
 
-    if config.frame_rate is not None:
-        video = video.set_fps(config.frame_rate)
+    try:
+        stdout, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        # A cancelled upload must not leave the process encoding in the background
+        if process.returncode is None:
+            process.kill()
+
+        await process.wait()
+        raise
+
+    if process.returncode != 0:
+        raise RuntimeError(f"{args[0]} exited with {process.returncode}: {stderr.decode(errors='replace')}")
+
+    return stdout
+
+
+def stream_rotation(stream: dict) -> int:
+    """Rotation of a video stream in degrees, from its display matrix or the legacy rotate tag"""
+    for side_data in stream.get("side_data_list", []):
+        if "rotation" in side_data:
+            return round(float(side_data["rotation"]))
+
+    return round(float(stream.get("tags", {}).get("rotate", 0)))
+
+
+async def probe_video(video: str) -> VideoInfo:
+    """Probe video"""
+    probe = json.loads(
+        await run_process(
+            "ffprobe", "-v", "error", "-print_format", "json", "-show_streams", "-show_format", video
+        )
+    )
+    streams: list[dict] = probe["streams"]
+    stream = next((stream for stream in streams if stream["codec_type"] == "video"), None)
+
+    if stream is None:
+        raise ValueError("No video stream")
+
+    duration = probe.get("format", {}).get("duration", stream.get("duration"))
+
+    if duration is None:
+        raise ValueError("Unknown video duration")
+
+    numerator, denominator = map(int, stream["avg_frame_rate"].split("/"))
+
+    if not denominator:
+        numerator, denominator = map(int, stream["r_frame_rate"].split("/"))
+
+    width, height = int(stream["width"]), int(stream["height"])
+
+    # ffmpeg autorotates while decoding, so filters and the stored size use the displayed orientation
+    if stream_rotation(stream) % 180 == 90:
+        width, height = height, width
+
+    return VideoInfo(
+        width=width,
+        height=height,
+        duration=float(duration),
+        frame_rate=numerator / denominator if denominator else 0,
+        audio=any(stream["codec_type"] == "audio" for stream in streams),
+    )
 
-    if config.mute:
-        video = video.without_audio()
 
-    width, height = video.size
+def video_filters(info: VideoInfo, config: VideoConfig) -> tuple[list[str], int, int]:
+    """Build the ffmpeg filters of the fit, returns the filters and the output size"""
+    width, height = info.width, info.height
+    filters: list[str] = []
 
     match config.fit:
         case "cover":
@@ -66,13 +137,11 @@ def process_video(group_id: str, video: VideoClip, config: VideoConfig) -> Proce
                 new_width = width
                 new_height = int(new_width / target_aspect)
 
-            video = video.crop(
-                x1=(width - new_width) // 2,
-                y1=(height - new_height) // 2,
-                width=new_width,
-                height=new_height,
+            filters.append(
+                f"crop={new_width}:{new_height}:{(width - new_width) // 2}:{(height - new_height) // 2}"
             )
-            video = video.resize((config.width, config.height))
+            filters.append(f"scale={config.width}:{config.height}")
+            width, height = config.width, config.height
 
         case "contain":
             original_aspect = width / height
@@ -87,21 +156,17 @@ def process_video(group_id: str, video: VideoClip, config: VideoConfig) -> Proce
 
             margin_left = (config.width - resize_width) // 2
             margin_top = (config.height - resize_height) // 2
-            margin_right = config.width - resize_width - margin_left
-            margin_bottom = config.height - resize_height - margin_top
 
-            video = video.resize((resize_width, resize_height))
+            filters.append(f"scale={resize_width}:{resize_height}")
+            width, height = resize_width, resize_height
 
             if original_aspect != target_aspect:
-                video = video.margin(
-                    left=margin_left,
-                    top=margin_top,
-                    right=margin_right,
-                    bottom=margin_bottom,
-                )
+                filters.append(f"pad={config.width}:{config.height}:{margin_left}:{margin_top}")
+                width, height = config.width, config.height
 
         case "fill":
-            video = video.resize((config.width, config.height))
+            filters.append(f"scale={config.width}:{config.height}")
+            width, height = config.width, config.height
 
         case "inside":
             original_aspect = width / height
@@ -114,7 +179,8 @@ def process_video(group_id: str, video: VideoClip, config: VideoConfig) -> Proce
                 resize_height = config.height
                 resize_width = int(config.height * original_aspect)
 
-            video = video.resize((resize_width, resize_height))
+            filters.append(f"scale={resize_width}:{resize_height}")
+            width, height = resize_width, resize_height
 
         case "outside":
             original_aspect = width / height
@@ -127,63 +193,86 @@ def process_video(group_id: str, video: VideoClip, config: VideoConfig) -> Proce
                 resize_width = config.width
                 resize_height = int(config.width / original_aspect)
 
-            video = video.resize((resize_width, resize_height))
+            filters.append(f"scale={resize_width}:{resize_height}")
+            width, height = resize_width, resize_height
 
         case _:
             pass
 
-    width, height = video.size
+    if config.frame_rate is not None:
+        filters.append(f"fps={config.frame_rate}")
+
+    return filters, width, height
+
+
+def video_range(info: VideoInfo, config: VideoConfig) -> tuple[float, float]:
+    """Start and end time of the config within the video, negative times count from the end"""
+    start = 0 if config.start is None else config.start if config.start >= 0 else info.duration + config.start
+    end = (
+        info.duration if config.end is None else config.end if config.end >= 0 else info.duration + config.end
+    )
+    start, end = max(start, 0), min(end, info.duration)
+
+    if start >= end:
+        raise ValueError(f"Video range of {config.tag} is empty")
+
+    return start, end
+
+
+async def process_video(group_id: str, video: str, info: VideoInfo, config: VideoConfig) -> ProcessedVideo:
+    """Process video"""
+    start, end = video_range(info, config)
+    mute = config.mute or not info.audio
+
+    filters, width, height = video_filters(info, config)
     extension = extensions_dict[config.codec]
     video_file = video_real_path(group_id, config.tag)
 
-    if extension in ["ogv", "webm"]:
-        audio_codec = "libvorbis"
-        audio_extension = "ogg"
-    else:
-        audio_codec = "libmp3lame"
-        audio_extension = "mp3"
+    args = ["ffmpeg", "-y", "-v", "error", "-ss", str(start), "-i", video, "-t", str(end - start)]
 
-    temp_audio = path.join(env.TEMPORARY_PATH, f"{uuid4().hex}.{audio_extension}")
+    if filters:
+        args += ["-vf", ",".join(filters)]
 
-    video.write_videofile(
-        f"{video_file}.{extension}",
-        codec=config.codec,
-        bitrate=f"{config.bitrate}k" if config.bitrate is not None and config.codec == "libx264" else None,
-        audio_fps=config.audio_sample_rate or 44100,
-        audio_codec=audio_codec,
-        temp_audiofile=temp_audio,
-    )
+    args += ["-c:v", config.codec]
 
-    if os.path.exists(temp_audio):
-        os.remove(temp_audio)
+    if config.codec == "libx264":
+        # 4:2:0 chroma needs even dimensions
+        args += ["-pix_fmt", "yuv420p" if width % 2 == 0 and height % 2 == 0 else "yuv444p"]
 
-    os.rename(f"{video_file}.{extension}", video_file)
+        if config.bitrate is not None:
+            args += ["-b:v", f"{config.bitrate}k"]
 
-    image = ProcessedVideo(
+    if mute:
+        args += ["-an"]
+    else:
+        args += [
+            "-c:a",
+            "libvorbis" if extension in ["ogv", "webm"] else "libmp3lame",
+            "-ar",
+            str(config.audio_sample_rate or 44100),
+        ]
+
+    # Crop, scale, frame rate and encoding all run natively in a single ffmpeg process
+    async with process_semaphore:
+        await run_process(*args, f"{video_file}.{extension}")
+
+    await aiofiles.os.rename(f"{video_file}.{extension}", video_file)
+
+    return ProcessedVideo(
         tag=config.tag,
-        size=path.getsize(video_file),
+        size=await aiofiles.os.path.getsize(video_file),
         width=width,
         height=height,
-        start=(
-            0 if config.start is None else config.start if config.start > 0 else video.duration + config.start
-        ),
-        end=(
-            video.duration
-            if config.end is None
-            else config.end if config.end > 0 else video.duration + config.end
-        ),
-        duration=video.duration,
-        frame_rate=video.fps,
+        start=start,
+        end=end,
+        duration=end - start,
+        frame_rate=round(config.frame_rate or info.frame_rate),
         codec=config.codec,
         bitrate=config.bitrate if config.codec == "libx264" else None,
         mute=config.mute,
         audio_sample_rate=config.audio_sample_rate,
     )
 
-    video.close()
-
-    return image
-
 
 @dataclass
 class VideoProcessingResult:
@@ -192,7 +281,7 @@ class VideoProcessingResult:
 
 
 async def save_video(
-    video: str | VideoClip,
+    video: str,
     configs: list[VideoConfig],
     filename: str = "image.jpg",
 ) -> VideoProcessingResult:
@@ -201,64 +290,51 @@ async def save_video(
     if len(configs) == 0:
         raise ValueError("No video configuration")
 
-    loop = asyncio.get_event_loop()
+    info = await probe_video(video)
 
-    if not isinstance(video, VideoClip):
-        video = await loop.run_in_executor(thread_pool, VideoFileClip, video)
-        close = True
-    else:
-        close = False
+    # Checked before the group is inserted so an empty range leaves no group behind
+    for config in configs:
+        video_range(info, config)
 
-    try:
-        async with scope() as session:
-            group = VideoGroup(
-                filename=filename,
-                width=video.w,
-                height=video.h,
-                duration=video.duration,
-                frame_rate=video.fps,
-                mute=video.audio is None,
+    async with scope() as session:
+        group_id = (
+            await session.execute(
+                insert(VideoGroup).values(
+                    filename=filename,
+                    width=info.width,
+                    height=info.height,
+                    duration=info.duration,
+                    frame_rate=round(info.frame_rate),
+                    mute=not info.audio,
+                )
             )
+        ).inserted_primary_key[0]
+        await session.commit()
 
-            session.add(group)
-            await session.commit()
-            await session.refresh(group, ["id"])
-
-            group_id = group.id
-            features = [
-                loop.run_in_executor(thread_pool, process_video, group_id, video, config)
-                for config in configs
-            ]
-
-            videos: list[ProcessedVideo] = []
-
-            while features:
-                done, features = await asyncio.wait(features, return_when=asyncio.FIRST_COMPLETED)
-
-                for future in done:
-                    processed: ProcessedVideo = future.result()
-
-                    session.add(
-                        Video(
-                            group_id=group_id,
-                            tag=processed.tag,
-                            size=processed.size,
-                            width=processed.width,
-                            height=processed.height,
-                            duration=processed.duration,
-                            frame_rate=processed.frame_rate,
-                            codec=processed.codec,
-                            bitrate=processed.bitrate,
-                            mute=processed.mute,
-                            audio_sample_rate=processed.audio_sample_rate,
-                        )
-                    )
-                    videos.append(processed)
-
-            await session.commit()
-    finally:
-        if close:
-            video.close()
+        videos: list[ProcessedVideo] = await asyncio.gather(
+            *[process_video(group_id, video, info, config) for config in configs]
+        )
+
+        await session.execute(
+            insert(Video),
+            [
+                {
+                    "group_id": group_id,
+                    "tag": processed.tag,
+                    "size": processed.size,
+                    "width": processed.width,
+                    "height": processed.height,
+                    "duration": processed.duration,
+                    "frame_rate": processed.frame_rate,
+                    "codec": processed.codec,
+                    "bitrate": processed.bitrate,
+                    "mute": processed.mute,
+                    "audio_sample_rate": processed.audio_sample_rate,
+                }
+                for processed in videos
+            ],
+        )
+        await session.commit()
 
     return VideoProcessingResult(
         id=group_id,
@@ -268,7 +344,7 @@ async def save_video(
 
 def video_real_path(group_id: str, tag: str) -> str:
     """Get real path"""
-    return path.join(env.VIDEO_PATH, f"{group_id}_{tag}")
+    return f"{VIDEO_PATH_PREFIX}{group_id}_{tag}"
 
 
 async def remove_video(group_id: str):
@@ -284,8 +360,6 @@ async def remove_video(group_id: str):
         await session.execute(delete(VideoGroup).where(VideoGroup.id == group_id))
         await session.commit()
 
-    for tag in tags:
-        if await aiofiles.os.path.exists(video_real_path(group_id, tag)):
-            await aiofiles.os.remove(video_real_path(group_id, tag))
+    await remove_files([video_real_path(group_id, tag) for tag in tags])
 
     return True
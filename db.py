@@ -15,8 +15,12 @@ engine = create_async_engine(
         {}
         if make_url(env.DATABASE_URL).get_dialect().name == "sqlite"
         else {
-            "pool_size": 1,
+            # One persistent connection per concurrent upload, LIFO keeps the recently used ones warm
+            "pool_size": max(env.IMAGE_PROCESSING_THREAD, env.VIDEO_PROCESSING_THREAD) * 2,
             "max_overflow": 10,
+            "pool_recycle": 1800,
+            "pool_timeout": 10,
+            "pool_use_lifo": True,
         }
     ),
 )
@@ -36,3 +36,12 @@ IMAGE_PROCESSING_THREAD: int = int(os.getenv("IMAGE_PROCESSING_THREAD", "8"))
 
 VIDEO_PROCESSING_THREAD: int = int(os.getenv("VIDEO_PROCESSING_THREAD", "4"))
 """Video processing thread"""
+
+IO_THREAD_POOL_SIZE: int = int(os.getenv("IO_THREAD_POOL_SIZE", "32"))
+"""File I/O thread pool size"""
+
+MAX_MEDIA_CONCURRENCY: int = int(os.getenv("MAX_MEDIA_CONCURRENCY", str(os.cpu_count() or 4)))
+"""Maximum number of uploaded files processed at once, per media type"""
+
+OPENCV_RESIZE: bool = os.getenv("OPENCV_RESIZE", "False").lower() == "true"
+"""Resize images with OpenCV"""
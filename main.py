@@ -1,8 +1,12 @@
+import asyncio
 import os
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
+from functools import partial
 
 from fastapi import FastAPI
 
+import core.image
 import env
 import router.image
 import router.video
@@ -11,6 +15,11 @@ from db import create_all
 
 @asynccontextmanager
 async def app_lifespan(app: FastAPI):
+    # Size the default executor used for file I/O
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=env.IO_THREAD_POOL_SIZE, thread_name_prefix="io")
+    )
+
     # Create a media directory
     os.makedirs(env.IMAGE_PATH, exist_ok=True)
     os.makedirs(env.VIDEO_PATH, exist_ok=True)
@@ -19,8 +28,16 @@ async def app_lifespan(app: FastAPI):
     # Create database tables
     await create_all()
 
+    core.image.log_image_backends()
+
     yield
 
+    # Stop the image worker processes if any were started, waiting on them off the event loop
+    if (process_pool := core.image.process_pool) is not None:
+        await asyncio.get_running_loop().run_in_executor(
+            None, partial(process_pool.shutdown, cancel_futures=True)
+        )
+
 
 app = FastAPI(lifespan=app_lifespan, docs_url="/swagger" if env.DEBUG else None, redoc_url=None)
 
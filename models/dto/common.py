@@ -0,0 +1,70 @@
+from typing import Annotated, Literal
+
+from pydantic import BaseModel, Field, StringConstraints, model_validator
+from pydantic_core import from_json
+
+TAG_PATTERN = "^[a-zA-Z0-9_-]+$"
+"""Pattern of tags and group IDs"""
+
+TagStr = Annotated[str, StringConstraints(min_length=1, max_length=255, pattern=TAG_PATTERN)]
+"""Tag or group ID"""
+
+
+class MediaConfig(BaseModel):
+    """Media configuration shared by images and videos"""
+
+    tag: TagStr = Field(..., description="Tag")
+    """Tag"""
+    width: int = Field(..., ge=1, description="Width")
+    """Width"""
+    height: int = Field(..., ge=1, description="Height")
+    """Height"""
+    fit: Literal[
+        "cover",
+        "contain",
+        "fill",
+        "inside",
+        "outside",
+    ] = Field(
+        "inside",
+        min_length=1,
+        max_length=255,
+        description="Fit\n- cover: Resize the image to fill the specified dimensions, cropping the image if necessary.\n- contain: Resize the image to fit within the specified dimensions, maintaining the original aspect ratio.\n- fill: Resize the image to the specified dimensions, cropping the image if necessary.\n- inside: Resize the image to be as large as possible while ensuring its dimensions are less than or equal to the specified dimensions.\n- outside: Resize the image to be as small as possible while ensuring its dimensions are greater than or equal to the specified dimensions.",
+    )
+    """
+    Fit
+    
+    - `cover`: Resize the image to fill the specified dimensions, cropping the image if necessary.
+    - `contain`: Resize the image to fit within the specified dimensions, maintaining the original aspect ratio.
+    - `fill`: Resize the image to the specified dimensions, cropping the image if necessary.
+    - `inside`: Resize the image to be as large as possible while ensuring its dimensions are less than or equal to the specified dimensions.
+    - `outside`: Resize the image to be as small as possible while ensuring its dimensions are greater than or equal to the specified dimensions.
+    """
+
+
+class MediaUploadRequest(BaseModel):
+    """Upload request shared by images and videos, sent as a JSON form field"""
+
+    configs: list[MediaConfig]
+    """Media configurations"""
+
+    @model_validator(mode="before")
+    @classmethod
+    def validate_to_json(cls, value):
+        # Only parsed here, the fields and the after validator then run once on the result
+        if isinstance(value, (str, bytes)):
+            value = from_json(value)
+
+        return value
+
+    @model_validator(mode="after")
+    def validate_unique_tags(self):
+        tags: set[str] = set()
+
+        for config in self.configs:
+            if config.tag in tags:
+                raise ValueError("Duplicate tags are not allowed")
+
+            tags.add(config.tag)
+
+        return self
@@ -1,41 +1,20 @@
-import json
 from typing import Literal
 
-from pydantic import BaseModel, Field, model_validator
+from pydantic import BaseModel, ConfigDict, Field
 
+from models.dto.common import MediaConfig, MediaUploadRequest, TagStr
 
-class ImageConfig(BaseModel):
+
+class ImageConfig(MediaConfig):
     """Image configuration"""
 
-    tag: str = Field(..., min_length=1, max_length=255, pattern="^[a-zA-Z0-9_\-]+$", description="Image Tag")
-    """Tag"""
-    width: int = Field(..., ge=1, description="Image Width")
-    """Image width"""
-    height: int = Field(..., ge=1, description="Image Height")
-    """Image height"""
-    fit: Literal[
-        "cover",
-        "contain",
-        "fill",
-        "inside",
-        "outside",
-    ] = Field(
-        "inside",
-        min_length=1,
-        max_length=255,
-        description="Image Fit\n- cover: Resize the image to fill the specified dimensions, cropping the image if necessary.\n- contain: Resize the image to fit within the specified dimensions, maintaining the original aspect ratio.\n- fill: Resize the image to the specified dimensions, cropping the image if necessary.\n- inside: Resize the image to be as large as possible while ensuring its dimensions are less than or equal to the specified dimensions.\n- outside: Resize the image to be as small as possible while ensuring its dimensions are greater than or equal to the specified dimensions.",
-    )
-    """
-    Fit
-    
-    - `cover`: Resize the image to fill the specified dimensions, cropping the image if necessary.
-    - `contain`: Resize the image to fit within the specified dimensions, maintaining the original aspect ratio.
-    - `fill`: Resize the image to the specified dimensions, cropping the image if necessary.
-    - `inside`: Resize the image to be as large as possible while ensuring its dimensions are less than or equal to the specified dimensions.
-    - `outside`: Resize the image to be as small as possible while ensuring its dimensions are greater than or equal to the specified dimensions.
-    """
     quality: int = Field(100, ge=0, le=100, description="Image Quality")
     """Quality (0-100)"""
+    optimize: bool = Field(
+        True,
+        description="Optimize Encoding. Extra encoder pass for a smaller output, disable it for faster encoding",
+    )
+    """Optimize encoding (extra encoder pass for a smaller output)"""
     content_type: Literal[
         "image/jpeg",
         "image/png",
@@ -59,7 +38,7 @@ class ImageConfig(BaseModel):
     """
 
 
-class ImageUploadRequest(BaseModel):
+class ImageUploadRequest(MediaUploadRequest):
     """Image upload request"""
 
     configs: list[ImageConfig] = Field(..., min_items=1, description="Image configurations")
@@ -76,23 +55,13 @@ class ImageUploadRequest(BaseModel):
     - `batch`: Use multiple configurations per image.
     """
 
-    @model_validator(mode="before")
-    @classmethod
-    def validate_to_json(cls, value):
-        if isinstance(value, str):
-            value = cls(**json.loads(value))
-
-        if isinstance(value, dict):
-            if len(set(config["tag"] for config in value["configs"])) != len(value["configs"]):
-                raise ValueError("Duplicate tags are not allowed")
-
-        return value
-
 
 class ProcessedImage(BaseModel):
     """Processed image"""
 
-    tag: str = Field(..., min_length=1, max_length=255, pattern="^[a-zA-Z0-9_\-]+$", description="Image Tag")
+    model_config = ConfigDict(frozen=True, extra="forbid")
+
+    tag: TagStr = Field(..., description="Image Tag")
     """Tag"""
     size: int = Field(..., ge=0, description="Size")
     """Size"""
@@ -128,10 +97,12 @@ class ProcessedImage(BaseModel):
 class ProcessedImageGroup(BaseModel):
     """Processed image group"""
 
+    model_config = ConfigDict(frozen=True, extra="forbid")
+
     status: Literal["success", "error"] = Field("success", description="Status")
     """Status"""
 
-    id: str = Field(..., min_length=1, max_length=255, pattern="^[a-zA-Z0-9_\-]+$", description="Group ID")
+    id: TagStr = Field(..., description="Group ID")
     """Group ID"""
     images: list[ProcessedImage] = Field(..., min_items=0, description="Processed images")
     """Processed images"""
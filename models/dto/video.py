@@ -1,39 +1,13 @@
-import json
 from typing import Literal
 
-from pydantic import BaseModel, Field, model_validator
+from pydantic import BaseModel, ConfigDict, Field
 
+from models.dto.common import MediaConfig, MediaUploadRequest, TagStr
 
-class VideoConfig(BaseModel):
+
+class VideoConfig(MediaConfig):
     """Video configuration"""
 
-    tag: str = Field(..., min_length=1, max_length=255, pattern="^[a-zA-Z0-9_\-]+$", description="Video Tag")
-    """Tag"""
-    width: int = Field(..., ge=1, description="Video Width")
-    """Video width"""
-    height: int = Field(..., ge=1, description="Video Height")
-    """Video height"""
-    fit: Literal[
-        "cover",
-        "contain",
-        "fill",
-        "inside",
-        "outside",
-    ] = Field(
-        "inside",
-        min_length=1,
-        max_length=255,
-        description="Image Fit\n- cover: Resize the image to fill the specified dimensions, cropping the image if necessary.\n- contain: Resize the image to fit within the specified dimensions, maintaining the original aspect ratio.\n- fill: Resize the image to the specified dimensions, cropping the image if necessary.\n- inside: Resize the image to be as large as possible while ensuring its dimensions are less than or equal to the specified dimensions.\n- outside: Resize the image to be as small as possible while ensuring its dimensions are greater than or equal to the specified dimensions.",
-    )
-    """
-    Fit
-    
-    - `cover`: Resize the image to fill the specified dimensions, cropping the image if necessary.
-    - `contain`: Resize the image to fit within the specified dimensions, maintaining the original aspect ratio.
-    - `fill`: Resize the image to the specified dimensions, cropping the image if necessary.
-    - `inside`: Resize the image to be as large as possible while ensuring its dimensions are less than or equal to the specified dimensions.
-    - `outside`: Resize the image to be as small as possible while ensuring its dimensions are greater than or equal to the specified dimensions.
-    """
     start: float | None = Field(None, description="Start Time (seconds). supported negative values")
     """Start time"""
     end: float | None = Field(None, description="End Time (seconds). supported negative values")
@@ -69,7 +43,7 @@ class VideoConfig(BaseModel):
     """Audio sample rate (Hz)"""
 
 
-class VideoUploadRequest(BaseModel):
+class VideoUploadRequest(MediaUploadRequest):
     """Video upload request"""
 
     configs: list[VideoConfig] = Field(..., min_items=1, description="Video configurations")
@@ -86,23 +60,13 @@ class VideoUploadRequest(BaseModel):
     - `batch`: Use multiple configurations per video.
     """
 
-    @model_validator(mode="before")
-    @classmethod
-    def validate_to_json(cls, value):
-        if isinstance(value, str):
-            value = cls(**json.loads(value))
-
-        if isinstance(value, dict):
-            if len(set(config["tag"] for config in value["configs"])) != len(value["configs"]):
-                raise ValueError("Duplicate tags are not allowed")
-
-        return value
-
 
 class ProcessedVideo(BaseModel):
     """Processed image"""
 
-    tag: str = Field(..., min_length=1, max_length=255, pattern="^[a-zA-Z0-9_\-]+$", description="Image Tag")
+    model_config = ConfigDict(frozen=True, extra="forbid")
+
+    tag: TagStr = Field(..., description="Image Tag")
     """Tag"""
     size: int = Field(..., ge=0, description="Size")
     """Size"""
@@ -150,10 +114,12 @@ class ProcessedVideo(BaseModel):
 class ProcessedVideoGroup(BaseModel):
     """Processed video group"""
 
+    model_config = ConfigDict(frozen=True, extra="forbid")
+
     status: Literal["success", "error"] = Field("success", description="Status")
     """Status"""
 
-    id: str = Field(..., min_length=1, max_length=255, pattern="^[a-zA-Z0-9_\-]+$", description="Group ID")
+    id: TagStr = Field(..., description="Group ID")
     """Group ID"""
     videos: list[ProcessedVideo] = Field(..., min_items=0, description="Processed videos")
     """Processed videos"""
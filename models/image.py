@@ -1,7 +1,8 @@
 from datetime import datetime
 from uuid import uuid4
 
-from sqlalchemy import BigInteger, Column, DateTime, ForeignKey, String
+from sqlalchemy import BigInteger, DateTime, ForeignKey, Index, Integer, SmallInteger, String, func
+from sqlalchemy.orm import Mapped, mapped_column
 
 import env
 from db import Base
@@ -9,69 +10,48 @@ from db import Base
 
 class Image(Base):
     __tablename__ = env.DATABASE_TABLE_PREFIX + "images"
+    __table_args__ = (Index(f"{__tablename__}_group_tag_idx", "group_id", "tag", unique=True),)
 
-    id: int = Column(BigInteger, primary_key=True, autoincrement=True)
+    id: Mapped[int] = mapped_column(
+        BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True
+    )
     """Image ID"""
-    group_id: str = Column(
+    group_id: Mapped[str] = mapped_column(
         String(255),
         ForeignKey(env.DATABASE_TABLE_PREFIX + "image_groups.id", ondelete="CASCADE"),
         nullable=False,
     )
     """Image group ID"""
-    tag = Column(String(255), nullable=False)
+    tag: Mapped[str] = mapped_column(String(255), nullable=False)
     """Tag"""
-    size: int = Column(BigInteger, nullable=False)
+    size: Mapped[int] = mapped_column(BigInteger, nullable=False)
     """Size"""
-    width: int = Column(BigInteger, nullable=False)
+    width: Mapped[int] = mapped_column(Integer, nullable=False)
     """Width"""
-    height: int = Column(BigInteger, nullable=False)
+    height: Mapped[int] = mapped_column(Integer, nullable=False)
     """Height"""
-    quality: int = Column(BigInteger, nullable=False)
+    quality: Mapped[int] = mapped_column(SmallInteger, nullable=False)
     """Quality"""
-    content_type: str = Column(String(255), nullable=False)
+    content_type: Mapped[str] = mapped_column(String(255), nullable=False)
     """Content type"""
 
-    def __init__(
-        self,
-        group_id: str,
-        tag: str,
-        size: int,
-        width: int,
-        height: int,
-        quality: int,
-        content_type: str,
-    ):
-        super().__init__(
-            group_id=group_id,
-            tag=tag,
-            size=size,
-            width=width,
-            height=height,
-            quality=quality,
-            content_type=content_type,
-        )
-
 
 class ImageGroup(Base):
     __tablename__ = env.DATABASE_TABLE_PREFIX + "image_groups"
 
-    id: str = Column(String(255), nullable=False, primary_key=True, default=lambda: uuid4().hex)
+    id: Mapped[str] = mapped_column(
+        String(255), nullable=False, primary_key=True, default=lambda: uuid4().hex
+    )
     """Image group ID"""
-    filename: str = Column(String(255), nullable=False)
+    filename: Mapped[str] = mapped_column(String(255), nullable=False)
     """Original filename"""
-    width: int = Column(BigInteger, nullable=False)
+    width: Mapped[int] = mapped_column(Integer, nullable=False)
     """Original width"""
-    height: int = Column(BigInteger, nullable=False)
+    height: Mapped[int] = mapped_column(Integer, nullable=False)
     """Original height"""
-    content_type: str = Column(String(255), nullable=False)
+    content_type: Mapped[str] = mapped_column(String(255), nullable=False)
     """Original content type"""
-    created_at: datetime = Column(DateTime, nullable=False, default=datetime.now)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), nullable=False, server_default=func.now()
+    )
     """Created at"""
-
-    def __init__(self, filename: str, width: int, height: int, content_type: str):
-        super().__init__(
-            filename=filename,
-            width=width,
-            height=height,
-            content_type=content_type,
-        )
@@ -1,7 +1,19 @@
 from datetime import datetime
 from uuid import uuid4
 
-from sqlalchemy import BigInteger, Column, DateTime, Double, ForeignKey, String
+from sqlalchemy import (
+    BigInteger,
+    Boolean,
+    DateTime,
+    Double,
+    ForeignKey,
+    Index,
+    Integer,
+    SmallInteger,
+    String,
+    func,
+)
+from sqlalchemy.orm import Mapped, mapped_column
 
 import env
 from db import Base
@@ -9,99 +21,60 @@ from db import Base
 
 class Video(Base):
     __tablename__ = env.DATABASE_TABLE_PREFIX + "videos"
+    __table_args__ = (Index(f"{__tablename__}_group_tag_idx", "group_id", "tag", unique=True),)
 
-    id: int = Column(BigInteger, primary_key=True, autoincrement=True)
+    id: Mapped[int] = mapped_column(
+        BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True
+    )
     """Video ID"""
-    group_id: str = Column(
+    group_id: Mapped[str] = mapped_column(
         String(255),
         ForeignKey(env.DATABASE_TABLE_PREFIX + "video_groups.id", ondelete="CASCADE"),
         nullable=False,
     )
     """Video group ID"""
-    tag = Column(String(255), nullable=False)
+    tag: Mapped[str] = mapped_column(String(255), nullable=False)
     """Tag"""
-    size: int = Column(BigInteger, nullable=False)
+    size: Mapped[int] = mapped_column(BigInteger, nullable=False)
     """Size"""
-    width: int = Column(BigInteger, nullable=False)
+    width: Mapped[int] = mapped_column(Integer, nullable=False)
     """Width"""
-    height: int = Column(BigInteger, nullable=False)
+    height: Mapped[int] = mapped_column(Integer, nullable=False)
     """Height"""
-    duration: float = Column(Double, nullable=False)
+    duration: Mapped[float] = mapped_column(Double, nullable=False)
     """Duration in seconds"""
-    frame_rate: int = Column(BigInteger, nullable=False)
+    frame_rate: Mapped[int] = mapped_column(SmallInteger, nullable=False)
     """Frame rate"""
-    codec: str = Column(String(255), nullable=False)
+    codec: Mapped[str] = mapped_column(String(255), nullable=False)
     """Codec"""
-    bitrate: int | None = Column(BigInteger, nullable=True)
+    bitrate: Mapped[int | None] = mapped_column(Integer, nullable=True)
     """Bitrate"""
-    mute: bool = Column(String(255), nullable=False)
+    mute: Mapped[bool] = mapped_column(Boolean, nullable=False)
     """Mute"""
-    audio_sample_rate: int | None = Column(BigInteger, nullable=True)
+    audio_sample_rate: Mapped[int | None] = mapped_column(Integer, nullable=True)
     """Audio sample rate"""
 
-    def __init__(
-        self,
-        group_id: str,
-        tag: str,
-        size: int,
-        width: int,
-        height: int,
-        duration: float,
-        frame_rate: int,
-        codec: str,
-        bitrate: int | None,
-        mute: bool,
-        audio_sample_rate: int | None,
-    ):
-        super().__init__(
-            group_id=group_id,
-            tag=tag,
-            size=size,
-            width=width,
-            height=height,
-            duration=duration,
-            frame_rate=frame_rate,
-            codec=codec,
-            bitrate=bitrate,
-            mute=mute,
-            audio_sample_rate=audio_sample_rate,
-        )
-
 
 class VideoGroup(Base):
     __tablename__ = env.DATABASE_TABLE_PREFIX + "video_groups"
 
-    id: str = Column(String(255), nullable=False, primary_key=True, default=lambda: uuid4().hex)
+    id: Mapped[str] = mapped_column(
+        String(255), nullable=False, primary_key=True, default=lambda: uuid4().hex
+    )
     """Video group ID"""
-    filename: str = Column(String(255), nullable=False)
+    filename: Mapped[str] = mapped_column(String(255), nullable=False)
     """Original filename"""
-    width: int = Column(BigInteger, nullable=False)
+    width: Mapped[int] = mapped_column(Integer, nullable=False)
     """Original width"""
-    height: int = Column(BigInteger, nullable=False)
+    height: Mapped[int] = mapped_column(Integer, nullable=False)
     """Original height"""
-    duration: float = Column(Double, nullable=False)
+    duration: Mapped[float] = mapped_column(Double, nullable=False)
     """Duration in seconds"""
-    frame_rate: int = Column(BigInteger, nullable=False)
+    frame_rate: Mapped[int] = mapped_column(SmallInteger, nullable=False)
     """Frame rate"""
-    mute: bool = Column(String(255), nullable=False)
+    mute: Mapped[bool] = mapped_column(Boolean, nullable=False)
     """Mute"""
-    created_at: datetime = Column(DateTime, nullable=False, default=datetime.now)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), nullable=False, server_default=func.now()
+    )
     """Created at"""
-
-    def __init__(
-        self,
-        filename: str,
-        width: int,
-        height: int,
-        duration: float,
-        frame_rate: int,
-        mute: bool,
-    ):
-        super().__init__(
-            filename=filename,
-            width=width,
-            height=height,
-            duration=duration,
-            frame_rate=frame_rate,
-            mute=mute,
-        )
@@ -12,24 +12,37 @@ from fastapi import (
     Response,
     UploadFile,
 )
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from fastapi.security import HTTPBearer
 
+import env
 from core.auth import delete_role, upload_role
 from core.image import ImageProcessingResult, image_real_path, remove_image, save_image
+from models.dto.common import TAG_PATTERN
 from models.dto.image import (
     ImageUploadRequest,
     ImageUploadResponse,
     ProcessedImage,
     ProcessedImageGroup,
 )
-from utils.content_type import get_content_type
+from utils.content_type import get_file_info
 from utils.responses import file_response
+from utils.files import remove_files
+from utils.upload import spool_uploads
 
-router = APIRouter()
+router = APIRouter(default_response_class=ORJSONResponse)
 
 auth_scheme = HTTPBearer()
 
+image_semaphore = asyncio.Semaphore(env.MAX_MEDIA_CONCURRENCY)
+"""Limits the number of images processed at once across requests"""
+
+
+async def save_image_bounded(**kwargs) -> ImageProcessingResult:
+    """Save image once a processing slot is free"""
+    async with image_semaphore:
+        return await save_image(**kwargs)
+
 
 @router.post(
     "/",
@@ -67,45 +80,46 @@ async def post_image(
             detail="Number of images and configurations must be the same",
         )
 
-    groups = (
-        list(zip(images, [[config] for config in data.configs]))
-        if data.mode == "single"
-        else [(image, data.configs) for image in images]
-    )
-
-    processed = await asyncio.gather(
-        *[
-            save_image(
-                image=await image.read(),
-                configs=configs,
-                filename=image.filename,
-                content_type=image.content_type,
-            )
-            for image, configs in groups
-        ],
-        return_exceptions=True,
-    )
+    image_files = await spool_uploads(images)
 
-    def processed_image_group(group: BaseException | ImageProcessingResult):
-        if isinstance(group, BaseException):
-            return ProcessedImageGroup(status="error", id=uuid4().hex, images=[])
-
-        return ProcessedImageGroup(
-            id=group.id,
-            images=[
-                ProcessedImage(
-                    tag=image.tag,
-                    size=image.size,
-                    width=image.width,
-                    height=image.height,
-                    quality=image.quality,
+    try:
+        processed = await asyncio.gather(
+            *[
+                save_image_bounded(
+                    image=image_file,
+                    configs=[data.configs[i]] if data.mode == "single" else data.configs,
+                    filename=image.filename,
                     content_type=image.content_type,
                 )
-                for image in group.images
+                for i, (image_file, image) in enumerate(zip(image_files, images))
             ],
+            return_exceptions=True,
         )
 
-    return ImageUploadResponse(groups=[processed_image_group(group) for group in processed])
+        def processed_image_group(group: BaseException | ImageProcessingResult):
+            if isinstance(group, BaseException):
+                return ProcessedImageGroup.model_construct(status="error", id=uuid4().hex, images=[])
+
+            return ProcessedImageGroup.model_construct(
+                id=group.id,
+                images=[
+                    ProcessedImage.model_construct(
+                        tag=image.tag,
+                        size=image.size,
+                        width=image.width,
+                        height=image.height,
+                        quality=image.quality,
+                        content_type=image.content_type,
+                    )
+                    for image in group.images
+                ],
+            )
+
+        return ImageUploadResponse.model_construct(
+            groups=[processed_image_group(group) for group in processed]
+        )
+    finally:
+        await remove_files(image_files)
 
 
 @router.get(
@@ -118,19 +132,21 @@ async def post_image(
 )
 async def get_image(
     request: Request,
-    group_id: str = Path(..., regex="^[a-zA-Z0-9_\-]+$", description="Group ID"),
-    tag: str = Path(..., regex="^[a-zA-Z0-9_\-]+$", description="Tag"),
+    group_id: str = Path(..., regex=TAG_PATTERN, description="Group ID"),
+    tag: str = Path(..., regex=TAG_PATTERN, description="Tag"),
 ):
     """Get image"""
     path = image_real_path(group_id, tag)
 
-    if not (content_type := await get_content_type(path)):
+    if not (info := await get_file_info(path)):
         return Response(status_code=404)
 
     return file_response(
         path,
         range=request.headers.get("range"),
-        media_type=content_type,
+        media_type=info.content_type,
+        stat_result=info.stat_result,
+        if_none_match=request.headers.get("if-none-match"),
     )
 
 
@@ -157,9 +173,9 @@ async def get_image(
         },
     },
 )
-async def delete_image(group_id: str = Path(..., regex="^[a-zA-Z0-9_\-]+$", description="Group ID")):
+async def delete_image(group_id: str = Path(..., regex=TAG_PATTERN, description="Group ID")):
     """Delete image"""
     if not (await remove_image(group_id)):
         return HTTPException(status_code=404, detail="Image not found")
 
-    return JSONResponse(content={"status": "ok"})
+    return ORJSONResponse(content={"status": "ok"})
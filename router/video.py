@@ -1,9 +1,6 @@
 import asyncio
-from os import path
 from uuid import uuid4
 
-import aiofiles
-import aiofiles.os
 from fastapi import (
     APIRouter,
     Depends,
@@ -15,25 +12,37 @@ from fastapi import (
     Response,
     UploadFile,
 )
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from fastapi.security import HTTPBearer
 
 import env
 from core.auth import delete_role, upload_role
 from core.video import VideoProcessingResult, remove_video, save_video, video_real_path
+from models.dto.common import TAG_PATTERN
 from models.dto.video import (
     ProcessedVideo,
     ProcessedVideoGroup,
     VideoUploadRequest,
     VideoUploadResponse,
 )
-from utils.content_type import get_content_type
+from utils.content_type import get_file_info
 from utils.responses import file_response
+from utils.files import remove_files
+from utils.upload import spool_uploads
 
-router = APIRouter()
+router = APIRouter(default_response_class=ORJSONResponse)
 
 auth_scheme = HTTPBearer()
 
+video_semaphore = asyncio.Semaphore(env.MAX_MEDIA_CONCURRENCY)
+"""Limits the number of videos processed at once across requests"""
+
+
+async def save_video_bounded(**kwargs) -> VideoProcessingResult:
+    """Save video once a processing slot is free"""
+    async with video_semaphore:
+        return await save_video(**kwargs)
+
 
 @router.post(
     "/",
@@ -71,44 +80,29 @@ async def post_video(
             detail="Number of videos and configurations must be the same",
         )
 
-    video_files: list[str] = []
+    video_files = await spool_uploads(videos)
 
     try:
-        for video in videos:
-            video_files.append(file_path := path.join(env.TEMPORARY_PATH, uuid4().hex))
-
-            async with aiofiles.open(file_path, "wb") as file:
-                while content := await video.read(65536):
-                    await file.write(content)
-
         processed = await asyncio.gather(
             *[
-                save_video(
+                save_video_bounded(
                     video=video_file,
-                    configs=configs,
+                    configs=[data.configs[i]] if data.mode == "single" else data.configs,
                     filename=video.filename,
                 )
-                for video_file, video, configs in zip(
-                    video_files,
-                    videos,
-                    (
-                        [[config] for config in data.configs]
-                        if data.mode == "single"
-                        else [data.configs] * len(videos)
-                    ),
-                )
+                for i, (video_file, video) in enumerate(zip(video_files, videos))
             ],
             return_exceptions=True,
         )
 
         def processed_video_group(group: BaseException | VideoProcessingResult):
             if isinstance(group, BaseException):
-                return ProcessedVideoGroup(status="error", id=uuid4().hex, videos=[])
+                return ProcessedVideoGroup.model_construct(status="error", id=uuid4().hex, videos=[])
 
-            return ProcessedVideoGroup(
+            return ProcessedVideoGroup.model_construct(
                 id=group.id,
                 videos=[
-                    ProcessedVideo(
+                    ProcessedVideo.model_construct(
                         tag=video.tag,
                         size=video.size,
                         width=video.width,
@@ -126,11 +120,11 @@ async def post_video(
                 ],
             )
 
-        return VideoUploadResponse(groups=[processed_video_group(group) for group in processed])
+        return VideoUploadResponse.model_construct(
+            groups=[processed_video_group(group) for group in processed]
+        )
     finally:
-        for video_file in video_files:
-            if await aiofiles.os.path.exists(video_file):
-                await aiofiles.os.remove(video_file)
+        await remove_files(video_files)
 
 
 @router.get(
@@ -143,19 +137,21 @@ async def post_video(
 )
 async def get_video(
     request: Request,
-    group_id: str = Path(..., regex="^[a-zA-Z0-9_\-]+$", description="Group ID"),
-    tag: str = Path(..., regex="^[a-zA-Z0-9_\-]+$", description="Tag"),
+    group_id: str = Path(..., regex=TAG_PATTERN, description="Group ID"),
+    tag: str = Path(..., regex=TAG_PATTERN, description="Tag"),
 ):
     """Get video"""
     path = video_real_path(group_id, tag)
 
-    if not (content_type := await get_content_type(path)):
+    if not (info := await get_file_info(path)):
         return Response(status_code=404)
 
     return file_response(
         path,
         range=request.headers.get("range"),
-        media_type=content_type,
+        media_type=info.content_type,
+        stat_result=info.stat_result,
+        if_none_match=request.headers.get("if-none-match"),
     )
 
 
@@ -182,9 +178,9 @@ async def get_video(
         },
     },
 )
-async def delete_video(group_id: str = Path(..., regex="^[a-zA-Z0-9_\-]+$", description="Group ID")):
+async def delete_video(group_id: str = Path(..., regex=TAG_PATTERN, description="Group ID")):
     """Delete video"""
     if not (await remove_video(group_id)):
         return HTTPException(status_code=404, detail="Video not found")
 
-    return JSONResponse(content={"status": "ok"})
+    return ORJSONResponse(content={"status": "ok"})
@@ -0,0 +1,29 @@
+import os
+import unittest
+
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite://")
+
+import PIL.Image
+
+from core.image import compile_transform, intermediate_image, intermediate_scale
+from models.dto.image import ImageConfig
+
+
+class IntermediateImageTest(unittest.TestCase):
+    def test_16_bit_grayscale(self):
+        """Modes Pillow can't resample are converted before the shared downscale"""
+        source = PIL.Image.new("I;16", (2400, 1800), 4096)
+        configs = [
+            ImageConfig(tag="inside", width=300, height=300, fit="inside", content_type="image/jpeg"),
+            ImageConfig(tag="cover", width=300, height=300, fit="cover", content_type="image/png"),
+        ]
+
+        image = intermediate_image(source, intermediate_scale(source.size, configs))
+
+        self.assertEqual(
+            [compile_transform(config)(image).size for config in configs], [(300, 225), (300, 300)]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
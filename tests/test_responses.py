@@ -0,0 +1,125 @@
+import os
+import tempfile
+import unittest
+
+from utils.responses import OpenRange, file_etag, file_response, parse_range
+
+
+async def call(response) -> list[dict]:
+    """Run a response as a plain HTTP GET without extensions, returns the messages sent"""
+    messages = []
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        messages.append(message)
+
+    await response({"type": "http", "method": "GET", "headers": [], "extensions": {}}, receive, send)
+    return messages
+
+
+class ParseRangeTest(unittest.TestCase):
+    def test_valid(self):
+        self.assertEqual(parse_range("bytes=0-0"), OpenRange(0, 0))
+        self.assertEqual(parse_range("bytes=10-20"), OpenRange(10, 20))
+        self.assertEqual(parse_range("bytes=10-"), OpenRange(10))
+
+    def test_malformed(self):
+        for range in [
+            "",
+            "bytes=",
+            "bytes=-",
+            "bytes=-5",
+            "bytes=a-",
+            "bytes=1-b",
+            "items=0-1",
+            "bytes=0-1,3-4",
+        ]:
+            with self.subTest(range=range):
+                self.assertIsNone(parse_range(range))
+
+    def test_end_before_start(self):
+        self.assertIsNone(parse_range("bytes=5-2"))
+
+    def test_non_ascii_digits(self):
+        """Digits are read as int reads them, other numeric characters are malformed"""
+        self.assertEqual(parse_range("bytes=٣-٥"), OpenRange(3, 5))
+        self.assertIsNone(parse_range("bytes=²-"))
+        self.assertIsNone(parse_range("bytes=0-⅕"))
+
+
+class FileResponseTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.data = os.urandom(600_000)
+
+        with tempfile.NamedTemporaryFile(delete=False) as file:
+            file.write(self.data)
+
+        self.path = file.name
+        self.addCleanup(os.unlink, self.path)
+        self.stat_result = os.stat(self.path)
+        self.size = self.stat_result.st_size
+
+    async def get_range(self, range: str, stat_result: os.stat_result | None = None):
+        messages = await call(file_response(self.path, range=range, stat_result=stat_result))
+        body = b"".join(bytes(message["body"]) for message in messages[1:])
+
+        return messages[0]["status"], dict(messages[0]["headers"]), body
+
+    async def test_first_byte(self):
+        status, headers, body = await self.get_range("bytes=0-0", self.stat_result)
+
+        self.assertEqual(status, 206)
+        self.assertEqual(headers[b"content-range"], f"bytes 0-0/{self.size}".encode())
+        self.assertEqual(headers[b"content-length"], b"1")
+        self.assertEqual(body, self.data[:1])
+
+    async def test_open_range(self):
+        for start in [self.size - 1, 1000]:
+            with self.subTest(start=start):
+                status, headers, body = await self.get_range(f"bytes={start}-", self.stat_result)
+
+                self.assertEqual(status, 206)
+                self.assertEqual(
+                    headers[b"content-range"], f"bytes {start}-{self.size - 1}/{self.size}".encode()
+                )
+                self.assertEqual(headers[b"content-length"], str(self.size - start).encode())
+                self.assertEqual(body, self.data[start:])
+
+    async def test_unsatisfiable(self):
+        for range in [f"bytes={self.size}-", f"bytes={self.size}-{self.size + 10}"]:
+            for stat_result in [self.stat_result, None]:
+                with self.subTest(range=range, stat_result=stat_result):
+                    status, headers, body = await self.get_range(range, stat_result)
+
+                    self.assertEqual(status, 416)
+                    self.assertEqual(headers[b"content-range"], f"bytes */{self.size}".encode())
+                    self.assertEqual(body, b"")
+
+    async def test_malformed(self):
+        status, headers, _ = await self.get_range("bytes=5-2", self.stat_result)
+
+        self.assertEqual(status, 416)
+        self.assertEqual(headers[b"content-range"], f"bytes */{self.size}".encode())
+
+    async def test_not_modified(self):
+        etag = file_etag(self.stat_result)
+
+        for if_none_match in [etag, f"W/{etag}", "*", f'"other", {etag}']:
+            with self.subTest(if_none_match=if_none_match):
+                response = file_response(
+                    self.path, range="bytes=0-0", stat_result=self.stat_result, if_none_match=if_none_match
+                )
+
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response.headers["etag"], etag)
+
+        messages = await call(
+            file_response(self.path, range="bytes=0-0", stat_result=self.stat_result, if_none_match='"other"')
+        )
+        self.assertEqual(messages[0]["status"], 206)
+
+
+if __name__ == "__main__":
+    unittest.main()
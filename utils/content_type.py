@@ -1,30 +1,64 @@
-import aiofiles
+import asyncio
+import os
+from typing import NamedTuple
 
+Signature = tuple[tuple[int, bytes | tuple[bytes, ...]], ...]
+"""(offset, bytes or alternative bytes) parts that must all match"""
 
-async def get_content_type(file_path: str) -> str | None:
-    """Get content type"""
+SIGNATURES: list[tuple[str, Signature]] = [
+    ("image/jpeg", ((0, b"\xFF\xD8\xFF"),)),
+    ("image/png", ((0, b"\x89\x50\x4E\x47\x0D\x0A\x1A\x0A"),)),
+    ("image/webp", ((0, b"\x52\x49\x46\x46"), (8, b"\x57\x45\x42\x50"))),
+    ("image/avif", ((4, b"ftyp"), (8, (b"avif", b"avis")))),
+    ("image/gif", ((0, (b"GIF87", b"GIF89")),)),
+    ("video/mp4", ((4, b"ftyp"), (8, (b"isom", b"mp42")))),
+    ("video/webm", ((0, b"\x1A\x45\xDF\xA3"),)),
+    ("video/ogg", ((0, b"OggS"),)),
+]
+"""Content type signatures in priority order"""
 
+SIGNATURE_TABLE: dict[int, dict[int, list[tuple[str, Signature]]]] = {}
+"""Signatures by the offset and the value of their first byte"""
+
+for content_type, signature in SIGNATURES:
+    offset, prefix = signature[0]
+    first_byte = (prefix if isinstance(prefix, bytes) else prefix[0])[0]
+    SIGNATURE_TABLE.setdefault(offset, {}).setdefault(first_byte, []).append((content_type, signature))
+
+
+class FileInfo(NamedTuple):
+    content_type: str
+    stat_result: os.stat_result
+
+
+def read_header(file_path: str) -> tuple[bytes, os.stat_result] | None:
+    """Read the first 12 bytes and the stat of a file, None if it doesn't exist"""
     try:
-        async with aiofiles.open(file_path, "rb") as file:
-            header = await file.read(12)
+        fd = os.open(file_path, os.O_RDONLY)
     except FileNotFoundError:
         return None
 
-    if header[:3] == b"\xFF\xD8\xFF":
-        return "image/jpeg"
-    elif header[:8] == b"\x89\x50\x4E\x47\x0D\x0A\x1A\x0A":
-        return "image/png"
-    elif header[:4] == b"\x52\x49\x46\x46" and header[8:12] == b"\x57\x45\x42\x50":
-        return "image/webp"
-    elif header[4:12] == b"ftypavif" or header[4:12] == b"ftypavis":
-        return "image/avif"
-    elif header[:5] == b"GIF87" or header[:5] == b"GIF89":
-        return "image/gif"
-    elif header[4:12] == b"ftypisom" or header[4:12] == b"ftypmp42":
-        return "video/mp4"
-    elif header[:4] == b"\x1A\x45\xDF\xA3":
-        return "video/webm"
-    elif header[:4] == b"OggS":
-        return "video/ogg"
-
-    return "application/octet-stream"
+    try:
+        return os.read(fd, 12), os.fstat(fd)
+    finally:
+        os.close(fd)
+
+
+async def get_file_info(file_path: str) -> FileInfo | None:
+    """Get content type and stat"""
+
+    # Open, read, stat and close in a single executor hop
+    if (result := await asyncio.get_running_loop().run_in_executor(None, read_header, file_path)) is None:
+        return None
+
+    header, stat_result = result
+
+    # One lookup per signature offset leaves at most a couple of candidates,
+    # startswith compares them in place and takes the alternatives of a part in a single call
+    for offset, table in SIGNATURE_TABLE.items():
+        if len(header) > offset:
+            for content_type, signature in table.get(header[offset], ()):
+                if all(header.startswith(prefix, start) for start, prefix in signature):
+                    return FileInfo(content_type, stat_result)
+
+    return FileInfo("application/octet-stream", stat_result)
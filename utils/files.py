@@ -0,0 +1,16 @@
+import asyncio
+import os
+
+
+def unlink_files(file_paths: list[str]):
+    """Remove files, skipping the ones that are already gone"""
+    for file_path in file_paths:
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+
+
+async def remove_files(file_paths: list[str]):
+    """Remove files in a single executor call, skipping the ones that are already gone"""
+    await asyncio.get_running_loop().run_in_executor(None, unlink_files, file_paths)
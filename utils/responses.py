@@ -1,39 +1,60 @@
+import asyncio
 import os
-import re
 import stat
 import typing as t
+from dataclasses import dataclass
+from functools import lru_cache
 from urllib.parse import quote
 
 import aiofiles
 from aiofiles.os import stat as aio_stat
 from fastapi.responses import FileResponse
 from starlette.datastructures import Headers
-from starlette.exceptions import HTTPException
 from starlette.responses import Response, guess_type
 from starlette.staticfiles import StaticFiles
 from starlette.types import Receive, Scope, Send
 
-RANGE_REGEX = re.compile(r"^bytes=(?P<start>\d+)-(?P<end>\d*)$")
+PathLike = t.Union[str, "os.PathLike[str]"]
 
 
-PathLike = t.Union[str, "os.PathLike[str]"]
+@lru_cache(maxsize=1024)
+def file_headers(media_type: str, filename: str | None) -> tuple[tuple[bytes, bytes], ...]:
+    """Content type and disposition headers of a file"""
+    if media_type.startswith("text/") and "charset=" not in media_type.lower():
+        media_type += "; charset=utf-8"
+
+    headers = ((b"content-type", media_type.encode("latin-1")),)
+
+    if filename is not None:
+        quoted_filename = quote(filename)
+
+        if quoted_filename != filename:
+            content_disposition = f"attachment; filename*=utf-8''{quoted_filename}"
+        else:
+            content_disposition = f'attachment; filename="{filename}"'
+
+        headers += ((b"content-disposition", content_disposition.encode("latin-1")),)
 
+    return headers
 
-class OpenRange(t.NamedTuple):
+
+@dataclass(slots=True)
+class OpenRange:
     start: int
     end: t.Optional[int] = None
 
     def clamp(self, start: int, end: int) -> "ClosedRange":
-        begin = max(self.start, start)
-        end = min((x for x in (self.end, end) if x))
+        begin = self.start if self.start > start else start
 
-        begin = min(begin, end)
-        end = max(begin, end)
+        if self.end is not None and self.end < end:
+            end = self.end
 
+        # Left empty when the range starts past the end
         return ClosedRange(begin, end)
 
 
-class ClosedRange(t.NamedTuple):
+@dataclass(slots=True)
+class ClosedRange:
     start: int
     end: int
 
@@ -41,11 +62,20 @@ class ClosedRange(t.NamedTuple):
         return self.end - self.start + 1
 
     def __bool__(self) -> bool:
-        return len(self) > 0
+        return self.end >= self.start
 
 
 class RangedFileResponse(Response):
-    chunk_size = 65536
+    chunk_size = 1 << 18
+    """Slice size for ranges larger than max_chunk_size"""
+    max_chunk_size = 1 << 20
+    """Ranges up to this size are sent in a single slice"""
+    small_range_size = 1 << 15
+    """Ranges below this size are read on the loop when the file is at most small_file_size"""
+    small_file_size = 1 << 20
+    """Largest file whose small ranges are read on the loop, larger files (videos) are likely cold on disk"""
+    drop_cache_size = 1 << 26
+    """Ranges larger than this are dropped from the page cache once sent"""
 
     def __init__(
         self,
@@ -66,23 +96,24 @@ class RangedFileResponse(Response):
         if media_type is None:
             media_type = guess_type(filename or path)[0] or "text/plain"
         self.media_type = media_type
-        self.init_headers(headers or {})
-        if self.filename is not None:
-            content_disposition_filename = quote(self.filename)
-            if content_disposition_filename != self.filename:
-                content_disposition = f"attachment; filename*=utf-8''{content_disposition_filename}"
-            else:
-                content_disposition = f'attachment; filename="{self.filename}"'
-            self.headers.setdefault("content-disposition", content_disposition)
+        self.raw_headers = [
+            (key.lower().encode("latin-1"), value.encode("latin-1")) for key, value in (headers or {}).items()
+        ]
+        keys = {key for key, _ in self.raw_headers}
+        self.raw_headers.extend(
+            header for header in file_headers(media_type, filename) if header[0] not in keys
+        )
         self.stat_result = stat_result
 
     def set_range_headers(self, range: ClosedRange) -> None:
         assert self.stat_result
         total_length = self.stat_result.st_size
         content_length = len(range)
-        self.headers["content-range"] = f"bytes {range.start}-{range.end}/{total_length}"
-        self.headers["content-length"] = str(content_length)
-        pass
+        # Neither header is set beforehand, appending skips the scans of MutableHeaders
+        self.raw_headers.append(
+            (b"content-range", f"bytes {range.start}-{range.end}/{total_length}".encode())
+        )
+        self.raw_headers.append((b"content-length", str(content_length).encode()))
 
     async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         if self.stat_result is None:
@@ -96,38 +127,134 @@ class RangedFileResponse(Response):
                 if not stat.S_ISREG(mode):
                     raise RuntimeError(f"File at path {self.path} is not a file.")
 
-        byte_range = self.range.clamp(0, self.stat_result.st_size)
-        self.set_range_headers(byte_range)
+        byte_range = self.range.clamp(0, self.stat_result.st_size - 1)
 
-        async with aiofiles.open(self.path, mode="rb") as file:
-            await file.seek(byte_range.start)
+        # Ranges starting at or past the end of the file are unsatisfiable
+        if not byte_range:
             await send(
                 {
                     "type": "http.response.start",
-                    "status": 206,
-                    "headers": self.raw_headers,
+                    "status": 416,
+                    "headers": [
+                        (b"content-range", f"bytes */{self.stat_result.st_size}".encode()),
+                        (b"content-length", b"0"),
+                    ],
                 }
             )
-            if self.send_header_only:
-                await send({"type": "http.response.body", "body": b"", "more_body": False})
-            else:
-                remaining_bytes = len(byte_range)
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        self.set_range_headers(byte_range)
+        extensions = scope.get("extensions") or {}
+
+        start_message = {"type": "http.response.start", "status": 206, "headers": self.raw_headers}
+
+        if self.send_header_only:
+            await send(start_message)
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        # Pathsend has no offset, so the server can only take over ranges covering the whole file
+        if (
+            "http.response.pathsend" in extensions
+            and byte_range.start == 0
+            and len(byte_range) == self.stat_result.st_size
+        ):
+            await send(start_message)
+            await send({"type": "http.response.pathsend", "path": os.fspath(self.path)})
+            return
 
-                if not byte_range:
-                    await send({"type": "http.response.body", "body": b"", "more_body": False})
-                    return
+        fd = os.open(self.path, os.O_RDONLY)
+        read: asyncio.Future[bytes] | None = None
 
-                while remaining_bytes > 0:
-                    chunk_size = min(self.chunk_size, remaining_bytes)
-                    chunk = await file.read(chunk_size)
-                    remaining_bytes -= len(chunk)
+        try:
+            # A single read on the loop is cheaper than a round trip through the executor for small ranges
+            # of small files, a few probed bytes of a large video can still wait on the disk
+            if len(byte_range) < self.small_range_size and self.stat_result.st_size <= self.small_file_size:
+                body = os.pread(fd, len(byte_range), byte_range.start)
+                await send(start_message)
+                await send({"type": "http.response.body", "body": body, "more_body": False})
+                return
+
+            if hasattr(os, "posix_fadvise"):
+                # Read ahead the head of the range while the headers go out
+                os.posix_fadvise(fd, byte_range.start, len(byte_range), os.POSIX_FADV_SEQUENTIAL)
+                os.posix_fadvise(
+                    fd, byte_range.start, min(len(byte_range), self.max_chunk_size), os.POSIX_FADV_WILLNEED
+                )
+
+            # Servers with the zero-copy extension sendfile the range straight from the descriptor
+            if "http.response.zerocopysend" in extensions:
+                await send(start_message)
+
+                # The extension takes a file object, the descriptor itself is closed below
+                with os.fdopen(fd, "rb", closefd=False) as file:
                     await send(
                         {
-                            "type": "http.response.body",
-                            "body": chunk,
-                            "more_body": remaining_bytes > 0,
+                            "type": "http.response.zerocopysend",
+                            "file": file,
+                            "offset": byte_range.start,
+                            "count": len(byte_range),
+                            "more_body": False,
                         }
                     )
+                return
+
+            loop = asyncio.get_running_loop()
+            chunk_size = len(byte_range) if len(byte_range) <= self.max_chunk_size else self.chunk_size
+            end = byte_range.end + 1
+
+            # Disk reads run in the executor so a cold file never blocks the loop, each slice is read
+            # while the previous one is sent and the first one while the headers go out
+            read = loop.run_in_executor(None, os.pread, fd, chunk_size, byte_range.start)
+            await send(start_message)
+
+            for start in range(byte_range.start, end, chunk_size):
+                body = await read
+
+                if (next_start := start + chunk_size) < end:
+                    read = loop.run_in_executor(
+                        None, os.pread, fd, min(chunk_size, end - next_start), next_start
+                    )
+
+                await send({"type": "http.response.body", "body": body, "more_body": next_start < end})
+        finally:
+            # A read still running in the executor has to finish before its descriptor is closed
+            if read is not None:
+                await asyncio.wait([read])
+
+            if len(byte_range) > self.drop_cache_size and hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(fd, byte_range.start, len(byte_range), os.POSIX_FADV_DONTNEED)
+
+            os.close(fd)
+
+
+def file_etag(stat_result: os.stat_result) -> str:
+    """Strong ETag from the modification time and size of a file"""
+    return f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+
+def is_not_modified(if_none_match: str, etag: str) -> bool:
+    """Whether an If-None-Match header matches the ETag"""
+    return if_none_match.strip() == "*" or etag in (
+        tag.strip().removeprefix("W/") for tag in if_none_match.split(",")
+    )
+
+
+def parse_range(range: str) -> OpenRange | None:
+    """Parse a single `bytes=start-end` Range header, None if it is malformed or ends before it starts"""
+    start, separator, end = range.removeprefix("bytes=").partition("-")
+
+    # isdecimal accepts the same digits as int, unlike isdigit
+    if not (range.startswith("bytes=") and separator and start.isdecimal() and (not end or end.isdecimal())):
+        return None
+
+    open_range = OpenRange(int(start), int(end) if end else None)
+
+    if open_range.end is not None and open_range.end < open_range.start:
+        return None
+
+    return open_range
 
 
 def file_response(
@@ -135,24 +262,39 @@ def file_response(
     range: str | None = None,
     media_type: str | None = None,
     filename: str | None = None,
+    stat_result: os.stat_result | None = None,
+    if_none_match: str | None = None,
 ) -> Response:
-    if range is not None:
-        match = RANGE_REGEX.match(range)
+    headers = None
+
+    if stat_result is not None:
+        headers = {"etag": file_etag(stat_result)}
 
-        if match is None:
-            raise HTTPException(416, "Invalid range")
+        # Cache revalidations are answered from the stat alone
+        if if_none_match is not None and is_not_modified(if_none_match, headers["etag"]):
+            return Response(status_code=304, headers=headers)
 
-        end = match.group("end")
+    if range is not None:
+        # Malformed ranges are answered directly rather than raised through the exception handlers
+        if (open_range := parse_range(range)) is None:
+            return Response(
+                status_code=416,
+                headers=None if stat_result is None else {"content-range": f"bytes */{stat_result.st_size}"},
+            )
 
         return RangedFileResponse(
             path,
-            OpenRange(int(match.group("start")), int(end) if end else None),
+            open_range,
+            headers=headers,
             media_type=media_type,
             filename=filename,
+            stat_result=stat_result,
         )
 
     return FileResponse(
         path,
+        headers=headers,
         media_type=media_type,
         filename=filename,
+        stat_result=stat_result,
     )
@@ -0,0 +1,41 @@
+import asyncio
+from os import path
+from uuid import uuid4
+
+import aiofiles
+from fastapi import UploadFile
+
+import env
+from utils.files import remove_files
+
+CHUNK_SIZE = 1 << 20
+"""Upload copy chunk size (1 MiB)"""
+
+
+async def spool_upload(upload: UploadFile) -> str:
+    """Copy an upload to a temporary file, returns its path"""
+    file_path = path.join(env.TEMPORARY_PATH, uuid4().hex)
+
+    try:
+        async with aiofiles.open(file_path, "wb") as file:
+            while content := await upload.read(CHUNK_SIZE):
+                await file.write(content)
+    except BaseException:
+        await remove_files([file_path])
+        raise
+
+    return file_path
+
+
+async def spool_uploads(uploads: list[UploadFile]) -> list[str]:
+    """Copy uploads to temporary files concurrently, none are left behind if one fails"""
+    results: list[str | BaseException] = await asyncio.gather(
+        *[spool_upload(upload) for upload in uploads], return_exceptions=True
+    )
+
+    for result in results:
+        if isinstance(result, BaseException):
+            await remove_files([file_path for file_path in results if isinstance(file_path, str)])
+            raise result
+
+    return results